@@ -0,0 +1,121 @@
+"""Noyaux Numba : matrice des scores et heuristique de construction du diaporama.
+
+Les noyaux sont compilés à la première utilisation puis mis en cache sur disque
+(cache=True) : seul le premier lancement paie la compilation. slideshow.py les
+utilise en priorité, ce qui garde les boucles prange parallèles.
+
+Lancer ``python kernels.py`` les compile à l'avance dans le module
+``slideshow_kernels``, qui ne dépend pas de numba à l'exécution. slideshow.py ne le
+charge que si numba est indisponible : la compilation AOT ne gère pas
+parallel=True, score_matrix et multi_start y tournent donc en série.
+"""
+import numpy as np
+from numba import njit, prange
+
+@njit('int64(uint64)', cache=True)
+def popcount(word):
+    """Compte les bits à 1 d'un mot de 64 bits (méthode SWAR)."""
+    word = word - ((word >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    word = (word & np.uint64(0x3333333333333333)) + ((word >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    word = (word + (word >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return np.int64((word * np.uint64(0x0101010101010101)) >> np.uint64(56))
+
+@njit('int32[:,:](uint64[:,:])', parallel=True, cache=True)
+def score_matrix(bits):
+    """Calcule la matrice des scores de transition min(tags communs, propres à i, propres à j)."""
+    num_slides, num_words = bits.shape
+    card = np.empty(num_slides, dtype=np.int64)
+    for i in prange(num_slides):
+        c = 0
+        for k in range(num_words):
+            c += popcount(bits[i, k])
+        card[i] = c
+
+    score = np.zeros((num_slides, num_slides), dtype=np.int32)
+    for i in prange(num_slides):
+        for j in range(i + 1, num_slides):
+            inter = 0
+            for k in range(num_words):
+                inter += popcount(bits[i, k] & bits[j, k])
+            s = min(inter, card[i] - inter, card[j] - inter)
+            score[i, j] = s
+            score[j, i] = s
+    return score
+
+@njit('int32[:](int32[:,:], int64)', cache=True)
+def greedy_tour(score, start):
+    """Construit un ordre glouton depuis start : chaque slide est suivie de sa meilleure voisine libre."""
+    num_slides = score.shape[0]
+    visited = np.zeros(num_slides, dtype=np.bool_)
+    tour = np.empty(num_slides, dtype=np.int32)
+    tour[0] = start
+    visited[start] = True
+    for k in range(1, num_slides):
+        best = -1
+        best_j = -1
+        for j in range(num_slides):
+            if not visited[j] and score[tour[k - 1], j] > best:
+                best = score[tour[k - 1], j]
+                best_j = j
+        tour[k] = best_j
+        visited[best_j] = True
+    return tour
+
+@njit('void(int32[:,:], int32[:])', cache=True)
+def two_opt(score, tour):
+    """Améliore l'ordre en place en inversant des segments tant que le score augmente."""
+    num_slides = tour.shape[0]
+    improved = True
+    while improved:
+        improved = False
+        # Balayage des segments tour[i..j] : toute inversion améliorante est appliquée aussitôt
+        for i in range(num_slides):
+            for j in range(i + 1, num_slides):
+                gain = 0
+                if i > 0:
+                    gain += score[tour[i - 1], tour[j]] - score[tour[i - 1], tour[i]]
+                if j < num_slides - 1:
+                    gain += score[tour[i], tour[j + 1]] - score[tour[j], tour[j + 1]]
+                if gain > 0:
+                    lo = i
+                    hi = j
+                    while lo < hi:
+                        tour[lo], tour[hi] = tour[hi], tour[lo]
+                        lo += 1
+                        hi -= 1
+                    improved = True
+
+@njit('int64(int32[:,:], int32[:])', cache=True)
+def tour_score(score, tour):
+    """Somme des scores de transition le long de l'ordre."""
+    total = 0
+    for k in range(tour.shape[0] - 1):
+        total += score[tour[k], tour[k + 1]]
+    return total
+
+@njit('int32[:](int32[:,:], int64)', parallel=True, cache=True)
+def multi_start(score, num_starts):
+    """Lance glouton + 2-opt depuis plusieurs slides en parallèle et garde le meilleur ordre."""
+    num_slides = score.shape[0]
+    best_scores = np.empty(num_starts, dtype=np.int64)
+    best_tours = np.empty((num_starts, num_slides), dtype=np.int32)
+    for s in prange(num_starts):
+        # Slides de départ réparties uniformément
+        tour = greedy_tour(score, s * num_slides // num_starts)
+        two_opt(score, tour)
+        best_scores[s] = tour_score(score, tour)
+        best_tours[s] = tour
+    return best_tours[np.argmax(best_scores)]
+
+
+if __name__ == "__main__":
+    from numba.pycc import CC
+
+    # La compilation AOT ne gère pas parallel=True : prange y devient une boucle simple
+    cc = CC('slideshow_kernels')
+    cc.export('score_matrix', 'i4[:,:](u8[:,:])')(score_matrix.py_func)
+    cc.export('greedy_tour', 'i4[:](i4[:,:], i8)')(greedy_tour.py_func)
+    cc.export('two_opt', 'void(i4[:,:], i4[:])')(two_opt.py_func)
+    cc.export('tour_score', 'i8(i4[:,:], i4[:])')(tour_score.py_func)
+    cc.export('multi_start', 'i4[:](i4[:,:], i8)')(multi_start.py_func)
+    cc.compile()
@@ -1,132 +1,280 @@
 import gurobipy as gp
 from gurobipy import GRB
+import numpy as np
+import scipy.sparse as sp
+import os
 import sys
+import mmap
 import logging
 import argparse
 
+try:
+    # Noyaux JIT parallèles, mis en cache sur disque après la première compilation
+    from kernels import score_matrix, multi_start, tour_score
+except ImportError:
+    # Sans numba : module compilé à l'avance (python kernels.py), en série
+    from slideshow_kernels import score_matrix, multi_start, tour_score
+
 # Initialisation de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 def read_input(file_path):
-    with open(file_path, 'r') as f:
-        lines = f.readlines()
+    # Lecture du fichier en un seul bloc via mmap
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            data = buf[:].decode()
     
-    num_photos = int(lines[0].strip())
-    horizontal = []
-    vertical = []
+    lines = data.split('\n')
+    num_photos = int(lines[0])
+    tokens = [line.split() for line in lines[1:num_photos + 1]]
     
-    for i in range(1, num_photos + 1):
-        parts = lines[i].strip().split()
-        orientation = parts[0]
-        tags = set(parts[2:])  # Assurez-vous que les tags sont des chaînes, pas des entiers
-        
-        if orientation == 'H':
-            horizontal.append((i - 1, tags))
-        else:
-            vertical.append((i - 1, tags))
-    
-    vertical_pairs = []
-    for i in range(0, len(vertical) - 1, 2):
-        v1, v2 = vertical[i], vertical[i + 1]
-        vertical_pairs.append((v1[0], v2[0], v1[1] | v2[1]))  # Fusionner les tags
+    # Les tags sont des chaînes internées (une seule copie par tag), stockées dans des frozenset
+    photos = [frozenset(map(sys.intern, parts[2:])) for parts in tokens]
+    vertical = [(i, tags) for i, (parts, tags) in enumerate(zip(tokens, photos)) if parts[0] != 'H']
     
+    # Une slide est le tuple des indices de ses photos : (h,) ou (v1, v2)
+    horizontal = [(i,) for i, parts in enumerate(tokens) if parts[0] == 'H']
+    vertical_pairs = pair_verticals(vertical)
     slides = horizontal + vertical_pairs
-    return slides
+    
+    # Vecteurs de bits des slides : une paire verticale est le OU binaire de ses deux photos
+    photo_bits = pack_tags(photos)
+    first = np.array([slide[0] for slide in vertical_pairs], dtype=np.int64)
+    second = np.array([slide[1] for slide in vertical_pairs], dtype=np.int64)
+    bits = np.concatenate((photo_bits[[slide[0] for slide in horizontal]], photo_bits[first] | photo_bits[second]))
+    return slides, bits
 
-def interest_factor(tags1, tags2):
-    """Calcule le score de transition entre deux slides."""
-    # Vérification que tags1 et tags2 sont bien des sets
-    if not isinstance(tags1, set) or not isinstance(tags2, set):
-        logging.error(f"tags1 ou tags2 ne sont pas des sets: {tags1}, {tags2}")
-        return 0
+def pair_verticals(vertical):
+    """Associe les photos verticales deux à deux en cherchant des tags peu recouvrants."""
+    if len(vertical) < 2:
+        return []
+    
+    # Signature MinHash 32 bits de chaque ensemble de tags
+    # (tags numérotés par ordre alphabétique pour un résultat reproductible)
+    vocabulary = sorted({tag for _, tags in vertical for tag in tags})
+    tag_id = {tag: k for k, tag in enumerate(vocabulary)}
+    tag_ids = [tag_id[tag] for _, tags in vertical for tag in tags]
+    sizes = np.array([len(tags) for _, tags in vertical])
+    rng = np.random.default_rng(np.random.SeedSequence(2019))
+    hashes = rng.integers(0, 2**32, size=len(tag_id), dtype=np.uint32)
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    signature = np.minimum.reduceat(hashes[tag_ids], offsets)
     
-    return min(len(tags1.intersection(tags2)), 
-               len(tags1.difference(tags2)), 
-               len(tags2.difference(tags1)))
+    # Des signatures proches indiquent des tags similaires : on associe chaque
+    # photo à celle située une demi-liste plus loin dans l'ordre des signatures
+    order = np.argsort(signature, kind='stable')
+    half = len(order) // 2
+    vertical_pairs = []
+    for k in range(half):
+        v1, v2 = vertical[order[k]], vertical[order[k + half]]
+        vertical_pairs.append((v1[0], v2[0]))
+    return vertical_pairs
+
+def pack_tags(tag_sets):
+    """Encode chaque ensemble de tags en vecteur de bits (un bit par tag unique)."""
+    tag_id = {}
+    tag_ids = np.array([tag_id.setdefault(tag, len(tag_id)) for tags in tag_sets for tag in tags], dtype=np.int64)
+    rows = np.repeat(np.arange(len(tag_sets)), [len(tags) for tags in tag_sets])
+
+    num_words = max(1, (len(tag_id) + 63) // 64)
+    bits = np.zeros((len(tag_sets), num_words), dtype=np.uint64)
+    np.bitwise_or.at(bits, (rows, tag_ids // 64), np.uint64(1) << (tag_ids % 64).astype(np.uint64))
+    return bits
+
+def follow_path(neighbors, start, visited):
+    """Parcourt la chaîne de transitions depuis start et marque les slides visitées."""
+    path = []
+    current = start
+    while current != -1:
+        visited[current] = True
+        path.append(current)
+        current = next((k for k in neighbors[current] if not visited[k]), -1)
+    return path
+
+def find_subtour(neighbors):
+    """Retourne le plus petit cycle formé par les transitions sélectionnées, ou None."""
+    num_slides = len(neighbors)
+    visited = [False] * num_slides
+
+    # Les slides reliées à une extrémité de chemin ne sont pas dans un cycle
+    for i in range(num_slides):
+        if len(neighbors[i]) < 2 and not visited[i]:
+            follow_path(neighbors, i, visited)
+
+    # Toute slide restante appartient à un cycle
+    shortest = None
+    for i in range(num_slides):
+        if not visited[i]:
+            cycle = follow_path(neighbors, i, visited)
+            if shortest is None or len(cycle) < len(shortest):
+                shortest = cycle
+    return shortest
+
+def selected_neighbors(num_slides, first, second, values):
+    """Liste les voisines de chaque slide d'après les transitions sélectionnées."""
+    neighbors = [[] for _ in range(num_slides)]
+    for e in np.flatnonzero(values > 0.5):
+        i, j = first[e], second[e]
+        neighbors[i].append(j)
+        neighbors[j].append(i)
+    return neighbors
+
+def subtour_elimination(model, where):
+    """Callback Gurobi : ajoute une coupe paresseuse sur le plus petit sous-tour."""
+    if where != GRB.Callback.MIPSOL:
+        return
 
-def optimize_slideshow(slides):
+    first, second = model._pairs
+    vals = model.cbGetSolution(model._y)
+    cycle = find_subtour(selected_neighbors(model._num_slides, first, second, vals))
+    if cycle:
+        in_cycle = np.zeros(model._num_slides, dtype=bool)
+        in_cycle[cycle] = True
+        inside = np.flatnonzero(in_cycle[first] & in_cycle[second])
+        model.cbLazy(model._y[inside].sum() <= len(cycle) - 1)
+
+def configure_model(model, time_limit=300, mip_gap=None, threads=None):
+    """Règle les paramètres de Gurobi pour la structure de chemin hamiltonien."""
+    model.Params.LazyConstraints = 1
+    model.Params.MIPFocus = 2  # La solution de départ est bonne : effort sur la borne
+    model.Params.Presolve = 2
+    model.Params.Cuts = 3
+    model.Params.Symmetry = 2
+    model.Params.Threads = threads or os.cpu_count()
+    model.Params.TimeLimit = time_limit
+    if mip_gap is not None:
+        model.Params.MIPGap = mip_gap
+
+def optimize_slideshow(slides, bits, starts=8, time_limit=300, mip_gap=None, threads=None):
     """Construit et résout le modèle d'optimisation avec Gurobi."""
     model = gp.Model("hashcode2019")
+    configure_model(model, time_limit, mip_gap, threads)
     num_slides = len(slides)
+    score = score_matrix(bits)
+    
+    # Rien à optimiser avec moins de deux slides
+    if num_slides < 2:
+        return format_solution(slides, list(range(num_slides)), score)
     
-    # Création des variables binaires
-    x = model.addVars(num_slides, num_slides, vtype=GRB.BINARY, name="x")
+    # Le score est symétrique : une variable binaire par paire i < j de slides
+    first, second = np.triu_indices(num_slides, k=1)
+    num_pairs = len(first)
+    y = model.addMVar(num_pairs, vtype=GRB.BINARY, name="y")
     
     # Fonction objectif
-    model.setObjective(gp.quicksum(
-        interest_factor(slides[i][-1], slides[j][-1]) * x[i, j]
-        for i in range(num_slides) for j in range(num_slides) if i != j),
-        GRB.MAXIMIZE
-)
+    model.setObjective(score[first, second] @ y, GRB.MAXIMIZE)
     
-    # Contraintes de flux
-    for i in range(num_slides):
-        model.addConstr(gp.quicksum(x[i, j] for j in range(num_slides) if i != j) == 1, name=f"slide_out_{i}")
-        model.addConstr(gp.quicksum(x[j, i] for j in range(num_slides) if i != j) == 1, name=f"slide_in_{i}")
+    # Contraintes de degré : le diaporama est un chemin, donc chaque slide a au
+    # plus deux voisines et les deux extrémités n'en ont qu'une
+    incidence = sp.csr_matrix(
+        (np.ones(2 * num_pairs), (np.concatenate((first, second)), np.tile(np.arange(num_pairs), 2))),
+        shape=(num_slides, num_pairs))
+    model.addConstr(incidence @ y <= 2, name="degree")
+    model.addConstr(y.sum() == num_slides - 1, name="transitions")
     
-    model.optimize()
+    # Solution de départ fournie par l'heuristique
+    tour = heuristic_tour(score, starts)
+    i = np.minimum(tour[:-1], tour[1:]).astype(np.int64)
+    j = np.maximum(tour[:-1], tour[1:]).astype(np.int64)
+    start = np.zeros(num_pairs)
+    start[i * num_slides - i * (i + 1) // 2 + (j - i - 1)] = 1.0  # Indice de (i, j) dans triu_indices
+    y.Start = start
     
-    if model.status != GRB.OPTIMAL:
-        logging.error(f"L'optimisation a échoué avec le statut {model.status}")
-        sys.exit(1)
+    # Les sous-tours sont éliminés paresseusement dans le callback
+    model._y = y
+    model._pairs = (first, second)
+    model._num_slides = num_slides
+    model.optimize(subtour_elimination)
     
-    # Initialisation de l'ordre des diapositives
-    order = [-1] * num_slides
-    used = set()
+    if model.SolCount == 0:
+        logging.warning(f"Gurobi n'a trouvé aucune solution (statut {model.status}), solution heuristique conservée")
+        return format_solution(slides, tour, score)
+    if model.status != GRB.OPTIMAL:
+        logging.warning(f"Optimisation interrompue (statut {model.status}), meilleure solution conservée avec un écart de {model.MIPGap:.2%}")
     
-    # Récupération de l'ordre des diapositives depuis les variables x
-    for i in range(num_slides):
-        for j in range(num_slides):
-            if i != j and x[i, j].x > 0.5:
-                order[i] = j
-                used.add(j)
+    # Récupération des transitions depuis les variables y en un seul appel
+    selected = y.X > 0.5
+    ends = np.concatenate((first[selected], second[selected]))
+    others = np.concatenate((second[selected], first[selected]))
+    degree = np.bincount(ends, minlength=num_slides)
     
     # Trouver la première diapositive
-    unused_slides = [i for i in range(num_slides) if i not in used]
-    if not unused_slides:
+    endpoints = np.flatnonzero(degree < 2)
+    if endpoints.size == 0:
         logging.error("Impossible de trouver un premier slide, toutes les diapositives semblent être utilisées.")
         sys.exit(1)
 
-    # Prendre la plus petite indice non utilisée comme première diapositive
-    first_slide = min(unused_slides)  # Prendre la plus petite indice non utilisée pour éviter les erreurs
-    solution = [first_slide]
+    # Prendre la plus petite extrémité du chemin comme première diapositive
+    first_slide = int(endpoints[0])
     
-    # Reconstruire l'ordre des diapositives
-    while order[first_slide] != -1:
-        first_slide = order[first_slide]
-        solution.append(first_slide)
+    # Table des (au plus deux) voisines de chaque slide, -1 si absente
+    by_end = np.argsort(ends, kind='stable')
+    sorted_ends = ends[by_end]
+    slot = np.arange(len(ends)) - np.searchsorted(sorted_ends, sorted_ends)
+    neighbors = np.full((num_slides, 2), -1)
+    neighbors[sorted_ends, slot] = others[by_end]
     
-    # Construction de la solution finale
+    # Reconstruire l'ordre des diapositives en suivant la chaîne (n étapes)
+    solution = [first_slide]
+    previous = -1
+    while len(solution) < num_slides:
+        current = solution[-1]
+        following = neighbors[current, 0] if neighbors[current, 0] != previous else neighbors[current, 1]
+        previous = current
+        solution.append(int(following))
+    
+    return format_solution(slides, solution, score)
+
+def heuristic_slideshow(slides, bits, starts=8):
+    """Construit un diaporama sans Gurobi : plus proche voisin puis 2-opt."""
+    if not slides:
+        return []
+
+    score = score_matrix(bits)
+    return format_solution(slides, heuristic_tour(score, starts), score)
+
+def heuristic_tour(score, starts):
+    """Calcule un ordre de slides par plus proche voisin puis 2-opt, depuis plusieurs départs."""
+    return multi_start(score, max(1, min(starts, len(score))))
+
+def format_solution(slides, solution, score):
+    """Convertit un ordre de slides en lignes du fichier de sortie."""
+    logging.info(f"Score du diaporama : {tour_score(score, np.asarray(solution, dtype=np.int32))}")
     result = []
     for slide in solution:
-        if len(slides[slide]) == 3:  # Si c'est une paire de photos verticales
-            result.append(f"{slides[slide][0]} {slides[slide][1]}")
-        else:
-            result.append(str(slides[slide][0]))
+        result.append(' '.join(str(photo) for photo in slides[slide]))
     
     return result
 
 def write_output(solution, output_path):
     """Écrit la solution dans un fichier output."""
-    with open(output_path, 'w') as f:
-        f.write(str(len(solution)) + '\n')
-        for slide in solution:
-            f.write(str(slide) + '\n')
+    # Contenu construit en mémoire puis écrit en une seule fois, en binaire
+    payload = f"{len(solution)}\n" + ''.join(f"{slide}\n" for slide in solution)
+    with open(output_path, 'wb') as f:
+        f.write(payload.encode())
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Optimisation du diaporama avec Gurobi pour HashCode 2019")
     parser.add_argument('input_file', type=str, help="Le fichier d'entrée contenant les données des photos")
     parser.add_argument('--output_file', type=str, default="slideshow.sol", help="Le fichier de sortie (par défaut : slideshow.sol)")
+    parser.add_argument('--heuristic', action='store_true', help="Utiliser l'heuristique plus proche voisin + 2-opt au lieu de Gurobi")
+    parser.add_argument('--starts', type=int, default=8, help="Nombre de départs de l'heuristique, exécutés en parallèle (par défaut : 8)")
+    parser.add_argument('--time_limit', type=float, default=300, help="Temps maximal de résolution Gurobi en secondes (par défaut : 300)")
+    parser.add_argument('--mip_gap', type=float, default=None, help="Écart d'optimalité relatif accepté, par exemple 0.01 (par défaut : celui de Gurobi)")
+    parser.add_argument('--threads', type=int, default=None, help="Nombre de threads Gurobi (par défaut : tous les cœurs)")
     
     args = parser.parse_args()
     
     try:
         logging.info(f"Lecture du fichier d'entrée : {args.input_file}")
-        slides = read_input(args.input_file)
+        slides, bits = read_input(args.input_file)
         logging.info(f"Nombre de diapositives générées : {len(slides)}")
         
         logging.info("Optimisation en cours...")
-        solution = optimize_slideshow(slides)
+        if args.heuristic:
+            solution = heuristic_slideshow(slides, bits, args.starts)
+        else:
+            solution = optimize_slideshow(slides, bits, args.starts, args.time_limit, args.mip_gap, args.threads)
         
         logging.info(f"Écriture du fichier de sortie : {args.output_file}")
         write_output(solution, args.output_file)